@@ -0,0 +1,116 @@
+"""
+Shared fixtures for the RappelConso MCP server tests.
+
+The server module is imported once and reused by every test, and the
+registered tools are listed once instead of in each test.
+"""
+
+import inspect
+
+import httpx
+import pytest
+import pytest_asyncio
+
+import server_rappel as server_rappel_module
+
+
+@pytest.fixture(scope="session")
+def server_rappel():
+    """The server module, shared by the whole session."""
+    return server_rappel_module
+
+
+@pytest.fixture(scope="session")
+def mcp_server(server_rappel):
+    """The FastMCP server instance."""
+    return server_rappel.mcp
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def tools(mcp_server):
+    """Registered tools, listed once for the session."""
+    return await mcp_server.get_tools()
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state(server_rappel):
+    """Drop the shared HTTP client and cached responses so each test starts from a clean module state.
+
+    Tests that need HTTP install their own client with `http_mock`.
+    """
+    server_rappel._client = None
+    server_rappel._cache.clear()
+    server_rappel._etag_cache.clear()
+    yield
+    server_rappel._client = None
+    server_rappel._cache.clear()
+    server_rappel._etag_cache.clear()
+
+
+@pytest_asyncio.fixture
+async def mock_client():
+    """Factory for `httpx.AsyncClient`s whose requests are answered by `httpx.MockTransport`.
+
+    Each argument answers one request, in order: a dict is sent as a 200 JSON body, an
+    `httpx.Response` as-is, an exception (e.g. `httpx.ConnectError`) is raised, and a
+    callable is called with the request (it may be async) to build the response. The
+    last one is reused for any further request. Keyword arguments go to the client.
+    Returns the client and the list of requests sent, for assertions on params and
+    headers. Clients are closed at teardown.
+    """
+    clients = []
+
+    def _make(*responses, **client_kwargs):
+        requests = []
+
+        async def handler(request):
+            requests.append(request)
+            response = responses[min(len(requests), len(responses)) - 1]
+            if isinstance(response, Exception):
+                raise response
+            if callable(response):
+                response = response(request)
+                if inspect.isawaitable(response):
+                    response = await response
+            if isinstance(response, httpx.Response):
+                return response
+            return httpx.Response(200, json=response)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), **client_kwargs)
+        clients.append(client)
+        return client, requests
+
+    yield _make
+    for client in clients:
+        await client.aclose()
+
+
+@pytest.fixture
+def http_mock(server_rappel, mock_client, monkeypatch):
+    """Like `mock_client`, but installs the client as server_rappel's shared client.
+
+    Returns the list of requests sent.
+    """
+    def _make(*responses):
+        client, requests = mock_client(*responses)
+        monkeypatch.setattr(server_rappel, "_client", client)
+        return requests
+
+    return _make
+
+
+@pytest.fixture(scope="session")
+def openapi_server():
+    """The OpenAPI-based server module (server.py); importing it does no network I/O."""
+    import server
+    return server
+
+
+@pytest.fixture
+def spec_cache(openapi_server, tmp_path, monkeypatch):
+    """Point the OpenAPI spec disk cache at an empty temporary RAPPEL_CONSO_CACHE_DIR."""
+    monkeypatch.setenv("RAPPEL_CONSO_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(openapi_server, "SPEC_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(openapi_server, "SPEC_CACHE_FILE", tmp_path / "swagger.json")
+    monkeypatch.setattr(openapi_server, "SPEC_META_FILE", tmp_path / "swagger.meta.json")
+    return tmp_path
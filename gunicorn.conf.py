@@ -0,0 +1,18 @@
+"""Gunicorn settings for serving `server_rappel:app` with several uvicorn workers.
+
+Usage: gunicorn server_rappel:app -c gunicorn.conf.py
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# One process per core (x2 + 1) so Pydantic validation is not limited to a single GIL.
+# WEB_CONCURRENCY overrides it on small instances.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# UvicornWorker picks uvloop and httptools when installed (uvicorn[standard]).
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 30
+# No access log, as with `uvicorn --no-access-log`: it costs more than the small JSON responses.
+accesslog = None
+errorlog = "-"
@@ -0,0 +1,81 @@
+"""HTTP helpers shared by both servers: response decoding and the optional aiohttp backend.
+
+With MCP_HTTP_BACKEND=aiohttp, requests made through `httpx.AsyncClient` are sent by an
+aiohttp connector instead of httpx's own transport. Callers (and the tests, which mock
+httpx) keep using the httpx API; only the wire I/O changes. aiohttp is imported lazily
+and only needs to be installed when the backend is enabled.
+"""
+
+import asyncio
+import os
+from typing import Any, Optional
+
+import httpx
+import orjson
+
+
+def decode_json(response: httpx.Response) -> Any:
+    """Decode a JSON response body with orjson rather than `response.json()` (stdlib json via str)."""
+    # orjson decodes straight from the bytes, several times faster on the large record / spec payloads.
+    return orjson.loads(response.content)
+
+
+def make_transport() -> Optional[httpx.AsyncBaseTransport]:
+    """Return the transport selected by MCP_HTTP_BACKEND, or None for httpx's default."""
+    if os.environ.get("MCP_HTTP_BACKEND", "httpx").lower() == "aiohttp":
+        return AiohttpTransport()
+    return None
+
+
+class AiohttpTransport(httpx.AsyncBaseTransport):
+    """httpx transport backed by a single pooled `aiohttp.ClientSession`."""
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 30, ttl_dns_cache: int = 300) -> None:
+        import aiohttp
+
+        self._aiohttp = aiohttp
+        self._connector_kwargs = {"limit": limit, "limit_per_host": limit_per_host, "ttl_dns_cache": ttl_dns_cache}
+        self._session: Optional[Any] = None
+
+    def _get_session(self) -> Any:
+        # The session binds to the running loop, so it is created on first request, not in __init__.
+        if self._session is None:
+            self._session = self._aiohttp.ClientSession(
+                connector=self._aiohttp.TCPConnector(**self._connector_kwargs),
+                # httpx decodes Content-Encoding itself from the response headers.
+                auto_decompress=False,
+            )
+        return self._session
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        aiohttp = self._aiohttp
+        timeout = request.extensions.get("timeout", {})
+        body = await request.aread()
+        try:
+            async with self._get_session().request(
+                request.method,
+                str(request.url),
+                headers=request.headers.multi_items(),
+                data=body or None,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(connect=timeout.get("connect"), sock_read=timeout.get("read")),
+            ) as resp:
+                content = await resp.read()
+                return httpx.Response(
+                    status_code=resp.status,
+                    headers=resp.raw_headers,
+                    content=content,
+                    request=request,
+                    extensions={"http_version": f"HTTP/{resp.version.major}.{resp.version.minor}".encode()},
+                )
+        except asyncio.TimeoutError as e:
+            raise httpx.TimeoutException(str(e) or "Timed out", request=request) from e
+        except aiohttp.ClientConnectionError as e:
+            raise httpx.ConnectError(str(e), request=request) from e
+        except aiohttp.ClientError as e:
+            raise httpx.TransportError(str(e), request=request) from e
+
+    async def aclose(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,7 +1,35 @@
+import asyncio
 import httpx
+import orjson
 import uvicorn
+from contextlib import asynccontextmanager
 from fastmcp import FastMCP
+from fastmcp.exceptions import ToolError
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+from http_backend import decode_json, make_transport
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
 import os
+import re
+import sys
+import time
+
+try:
+    import fastjsonschema
+except ImportError:
+    # Optional: without it, tool arguments are not pre-validated locally.
+    fastjsonschema = None
+
+try:
+    import ijson
+except ImportError:
+    # Optional: without it, a cold-start spec fetch is read whole and decoded with orjson.
+    ijson = None
+
+# Logs go to stderr: stdout is reserved for the MCP stdio protocol.
+logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                    format='[%(asctime)s] %(levelname)-8s %(message)s')
 
 # Set this just in case, to use the new parser
 os.environ["FASTMCP_EXPERIMENTAL_ENABLE_NEW_OPENAPI_PARSER"] = "true"
@@ -11,70 +39,284 @@ os.environ["FASTMCP_EXPERIMENTAL_ENABLE_NEW_OPENAPI_PARSER"] = "true"
 
 openapi_spec_url = "https://tabular-api.data.gouv.fr/api/resources/5a4e7174-657c-4920-af1f-3440a996837c/swagger/"
 
-# 2. Fetch the OpenAPI spec
-try:
-    print(f"Fetching OpenAPI spec from {openapi_spec_url}...")
-    response = httpx.get(openapi_spec_url)
-    response.raise_for_status()  # Raise an exception for bad status codes
-    spec = response.json()
-    print("Fetch successful.")
-except httpx.RequestError as e:
-    print(f"Error fetching OpenAPI spec: {e}")
-    exit(1)
-except Exception as e:
-    print(f"An error occurred: {e}")
-    exit(1)
+# The patched spec is cached on disk and served immediately on start (stale-while-revalidate):
+# once older than SPEC_TTL seconds it is revalidated in the background with If-None-Match /
+# If-Modified-Since, and a changed spec is picked up on the next start.
+SPEC_CACHE_DIR = Path(os.environ.get("RAPPEL_CONSO_CACHE_DIR", "~/.cache/rappel-conso")).expanduser()
+SPEC_CACHE_FILE = SPEC_CACHE_DIR / "swagger.json"
+SPEC_META_FILE = SPEC_CACHE_DIR / "swagger.meta.json"
+SPEC_TTL = float(os.environ.get("SPEC_TTL", "86400"))
+
+# One long-lived, pooled client (keep-alive, HTTP/2) is shared by the swagger fetch, its
+# revalidation and every API call made by the OpenAPI tools. Created in the lifespan.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+api_client: Optional[httpx.AsyncClient] = None
 
 
 # --- START: FIX ---
-# The error log shows the problem is in 'components.schemas.record'.
-# It uses 'additionalProperties: {"type": "any"}', which is invalid OpenAPI.
+# The error log showed the problem in 'components.schemas.record' (and its 'Reference' part):
+# it uses 'additionalProperties: {"type": "any"}', which is invalid OpenAPI.
 # The correct way to allow any other properties is 'additionalProperties: true'.
-# We will manually "patch" the spec in memory.
+# We "patch" the spec in memory, in a single iterative walk that fixes every occurrence,
+# so the same mistake elsewhere in the spec can't break the parser either.
+def _patch_node(root: Any) -> int:
+    patched = 0
+    stack: list = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            ap = node.get("additionalProperties")
+            if isinstance(ap, dict) and ap.get("type") == "any":
+                # Replace the invalid dictionary with a valid boolean
+                node["additionalProperties"] = True
+                patched += 1
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return patched
 
-try:
-    record_schema = spec.get("components", {}).get("schemas", {}).get("record", {})
-
-    # Check if the invalid 'additionalProperties' key exists
-    if record_schema and isinstance(record_schema.get("additionalProperties"), dict):
-        if record_schema["additionalProperties"].get("type") == "any":
-            print(
-                'Patching invalid \'additionalProperties: {"type": "any"}\' in spec...'
-            )
-            # Replace the invalid dictionary with a valid boolean
-            record_schema["additionalProperties"] = True
-            print("Patch applied.")
-
-    # Also patch the 'Reference' part which seems to be missing '$ref'
-    # and has the same 'additionalProperties' issue
-    record_ref_schema = record_schema.get("Reference", {})
-    if record_ref_schema and isinstance(
-        record_ref_schema.get("additionalProperties"), dict
-    ):
-        if record_ref_schema["additionalProperties"].get("type") == "any":
-            print("Patching 'Reference' schema...")
-            record_ref_schema["additionalProperties"] = True
-            print("Patch applied.")
-
-except Exception as e:
-    # This is not fatal, but good to know
-    print(f"Warning: Could not patch spec, but continuing. Error: {e}")
+
+def _log_patched(patched: int) -> None:
+    if patched:
+        logging.info(f'Patched {patched} invalid \'additionalProperties: {{"type": "any"}}\' in spec.')
+
+
+def patch_spec(spec: Dict[str, Any]) -> None:
+    _log_patched(_patch_node(spec))
 # --- END: FIX ---
 
 
-# 3. Create an HTTP client for the API
-base_url = spec.get("servers", [{}])[0].get("url", "https://data.economie.gouv.fr")
+def _read_cached_spec() -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    try:
+        spec = orjson.loads(SPEC_CACHE_FILE.read_bytes())
+        meta = orjson.loads(SPEC_META_FILE.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    return spec, meta
+
+
+def _write_meta(meta: Dict[str, Any]) -> None:
+    try:
+        SPEC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        SPEC_META_FILE.write_bytes(orjson.dumps(meta))
+    except OSError as e:
+        logging.warning(f"Could not write spec cache metadata: {e}")
+
+
+def _write_cached_spec(spec: Dict[str, Any], response: httpx.Response) -> Dict[str, Any]:
+    """Persist the patched spec with its validators; returns the new metadata."""
+    meta = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    try:
+        SPEC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write then rename so a concurrent start never reads a half-written spec.
+        tmp = SPEC_CACHE_FILE.with_suffix(".tmp")
+        tmp.write_bytes(orjson.dumps(spec, option=orjson.OPT_NON_STR_KEYS))
+        tmp.replace(SPEC_CACHE_FILE)
+    except OSError as e:
+        logging.warning(f"Could not write spec cache: {e}")
+        return meta
+    _write_meta(meta)
+    return meta
+
+
+# 2. Load the OpenAPI spec: from the disk cache when present, otherwise from the network
+async def load_spec(client: httpx.AsyncClient) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    cached = _read_cached_spec()
+    if cached is not None:
+        logging.info(f"Using cached OpenAPI spec from {SPEC_CACHE_FILE}")
+        return cached
+
+    try:
+        logging.info(f"Fetching OpenAPI spec from {openapi_spec_url}...")
+        async with client.stream("GET", openapi_spec_url) as response:
+            logging.debug(f"Spec fetched over {response.http_version} "
+                          f"(Content-Encoding: {response.headers.get('Content-Encoding', 'identity')})")
+            response.raise_for_status()  # Raise an exception for bad status codes
+            if ijson is not None:
+                spec = await _stream_patched_spec(response)
+            else:
+                await response.aread()
+                spec = decode_json(response)
+                patch_spec(spec)
+        logging.info("Fetch successful.")
+    except httpx.RequestError as e:
+        logging.error(f"Error fetching OpenAPI spec: {e}")
+        raise
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        raise
+
+    return spec, _write_cached_spec(spec, response)
+
+
+class _AsyncByteReader:
+    """Async file-like view of a streamed response body, as read by ijson's async API."""
+
+    def __init__(self, response: httpx.Response) -> None:
+        self._chunks = response.aiter_bytes()
+        self._buffer = b""
+
+    async def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+async def _stream_patched_spec(response: httpx.Response) -> Dict[str, Any]:
+    """Decode the spec one top-level entry at a time, patching each entry as soon as it is built.
+
+    The body is never held whole in memory next to the parsed tree, and each entry is patched
+    while it is still hot instead of in a second walk over the complete spec.
+    """
+    spec: Dict[str, Any] = {}
+    patched = 0
+    # use_float: plain floats (not Decimal) so the spec can be written back with orjson.
+    async for key, value in ijson.kvitems(_AsyncByteReader(response), "", use_float=True):
+        patched += _patch_node(value)
+        spec[key] = value
+    _log_patched(patched)
+    return spec
+
+
+async def _revalidate(client: httpx.AsyncClient, meta: Dict[str, Any]) -> None:
+    """Refresh the cached spec if it is older than SPEC_TTL; network failures keep the stale copy."""
+    if time.time() - meta.get("fetched_at", 0) < SPEC_TTL:
+        return
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        response = await client.get(openapi_spec_url, headers=headers)
+        if response.status_code == 304:
+            # Unchanged upstream: no parsing, just restart the TTL.
+            _write_meta({**meta, "fetched_at": time.time()})
+            return
+        response.raise_for_status()
+        new_spec = decode_json(response)
+        patch_spec(new_spec)
+        _write_cached_spec(new_spec, response)
+        logging.info("OpenAPI spec changed upstream; the new version will be used on next start.")
+    except Exception as e:
+        logging.warning(f"Could not revalidate OpenAPI spec, keeping the cached copy: {e}")
+
+
+# Section headers FastMCP appends to generated tool descriptions, each at the start of a line.
+_GENERATED_SECTIONS = re.compile(r"^\*\*(?:Path Parameters|Query Parameters|Request Body|Responses):\*\*", re.MULTILINE)
+
+
+def _trim_component(route: Any, component: Any) -> None:
+    """Keep only the operation's own description on each generated tool.
+
+    FastMCP appends "**Query Parameters:**", "**Request Body:**", "**Responses:**" (etc.)
+    sections, with response schemas and examples, to every description, all of which is sent
+    to the LLM on each tools/list. The parameters are already in the input schema, so drop
+    those sections; the operation's own text, bold paragraphs included, is kept.
+    """
+    if component.description:
+        component.description = _GENERATED_SECTIONS.split(component.description, 1)[0].rstrip()
+
+
+# 3. Build the OpenAPI tools at startup, once the event loop is running: importing this module
+# does no network I/O, and the tools are mounted on `mcp` before it serves any request.
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    global api_client
+    client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, http2=True, transport=make_transport())
+    try:
+        spec, spec_meta = await load_spec(client)
+
+        # Point the shared client at the API (the swagger URL above is absolute, so it was unaffected)
+        client.base_url = spec.get("servers", [{}])[0].get("url", "https://data.economie.gouv.fr")
+
+        # Create the FastMCP server from the (now patched) OpenAPI spec
+        logging.info("Creating MCP server from patched OpenAPI spec...")
+        openapi_tools = FastMCP.from_openapi(
+            openapi_spec=spec,  # Pass the patched spec
+            client=client,
+            mcp_component_fn=_trim_component,
+        )
+        server.mount(openapi_tools)
+    except Exception:
+        await client.aclose()
+        raise
+    api_client = client
+
+    revalidation = asyncio.create_task(_revalidate(client, spec_meta))
+    try:
+        yield
+    finally:
+        revalidation.cancel()
+        # The lifespan is re-entered per connection (e.g. each in-memory Client): drop this
+        # entry's mount so tools bound to the client closed below don't pile up.
+        server._mounted_servers[:] = [m for m in server._mounted_servers if m.server is not openapi_tools]
+        await client.aclose()
+        if api_client is client:
+            api_client = None
+
+
+class ArgumentValidation(Middleware):
+    """Validate tool arguments with a fastjsonschema validator compiled once per tool.
+
+    Invalid calls are rejected locally instead of costing a round-trip that ends in a 400.
+    Tools whose schema fastjsonschema rejects (e.g. `$ref` cycles) are passed through unchecked.
+    """
+
+    def __init__(self, server: FastMCP) -> None:
+        self._server = server
+        self._validators: Dict[str, Optional[Callable[[Any], Any]]] = {}
+
+    async def _validator(self, name: str) -> Optional[Callable[[Any], Any]]:
+        if name in self._validators:
+            return self._validators[name]
+        # NotFoundError (unknown tool) propagates: names are client-chosen and must not be cached.
+        tool = await self._server.get_tool(name)
+        try:
+            # use_default=False: the validator must not fill schema defaults into the arguments in place.
+            validator = fastjsonschema.compile(tool.parameters, use_default=False)
+        except fastjsonschema.JsonSchemaDefinitionException as e:
+            # The schema itself is unsupported: permanent, so remember to skip this tool.
+            logging.debug(f"No precompiled validator for tool {name}: {e}")
+            validator = None
+        except Exception as e:
+            # Anything else may be transient: skip validation for this call only.
+            logging.warning(f"Could not compile validator for tool {name}: {e}")
+            return None
+        self._validators[name] = validator
+        return validator
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        validator = await self._validator(context.message.name)
+        if validator is not None:
+            try:
+                validator(context.message.arguments or {})
+            except fastjsonschema.JsonSchemaValueException as e:
+                raise ToolError(f"Invalid arguments for {context.message.name}: {e.message}")
+        return await call_next(context)
 
-api_client = httpx.AsyncClient(base_url=base_url, timeout=30.0)
 
-# 4. Create the FastMCP server from the (now patched) OpenAPI spec
-print("Creating MCP server from patched OpenAPI spec...")
-mcp = FastMCP.from_openapi(
-    openapi_spec=spec,  # Pass the patched spec
-    client=api_client,
-)
+# 4. Create the FastMCP server; its tools come from the OpenAPI spec loaded in the lifespan
+mcp = FastMCP(name="RappelConso OpenAPI", lifespan=_lifespan)
+if fastjsonschema is not None:
+    mcp.add_middleware(ArgumentValidation(mcp))
 
 # 5. Make the server runnable
 if __name__ == "__main__":
-    print("Running server for testing...")
-    uvicorn.run(mcp, host="127.0.0.1", port=8000)
+    logging.info("Running server for testing...")
+    # uvloop + httptools (installed by uvicorn[standard]) instead of the asyncio loop and the
+    # pure-Python HTTP parser; uvloop has no Windows build, so fall back to asyncio there.
+    uvicorn.run(mcp.http_app(), host="127.0.0.1", port=8000,
+                loop="asyncio" if sys.platform == "win32" else "uvloop", http="httptools",
+                log_level="warning")
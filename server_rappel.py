@@ -0,0 +1,563 @@
+import asyncio
+import httpx
+import uvicorn
+import re
+from fastmcp import FastMCP
+from http_backend import decode_json, make_transport
+from pydantic import TypeAdapter, ValidationError
+from typing import Optional, Any, Awaitable, Callable, Dict, List, Tuple
+from models import ResultEntry
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from contextlib import asynccontextmanager
+from operator import itemgetter
+
+# Ensure logs go to stderr (not stdout) so they don't interfere with MCP stdio protocol.
+# Tool coroutines only enqueue records; a background QueueListener thread does the stderr I/O.
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_handler = logging.StreamHandler(sys.stderr)
+_log_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)-8s %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(_log_queue)])
+# 1. Définir l'URL de base de l'API que nous voulons
+# Remarque: le dataset correct observé dans les logs est `rappelconso-v2-gtin-espaces`.
+# Le dataset `rappelconso-v2-gtin-trie` renvoyait 404 d'après les logs.
+BASE_API_URL_ROOT = "https://data.economie.gouv.fr"
+BASE_API_URL = f"{BASE_API_URL_ROOT}/api/explore/v2.1/catalog/datasets/rappelconso-v2-gtin-espaces/records"
+
+# Shared HTTP client: one connection pool (keep-alive) reused by every tool call
+# instead of paying a new TCP + TLS handshake per request. HTTP/2 lets concurrent
+# tool calls multiplex over a single connection to the same host (requires `h2`).
+_client: httpx.AsyncClient | None = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use (e.g. when tools are called outside the lifespan)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=BASE_API_URL_ROOT,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30),
+            http2=True,
+            # MCP_HTTP_BACKEND=aiohttp swaps the wire I/O for aiohttp (see http_backend.py).
+            transport=make_transport(),
+        )
+    return _client
+
+
+async def startup() -> None:
+    _get_client()
+
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+
+# 2. Initialiser un serveur MCP simple
+# (Nous n'utilisons plus from_openapi)
+mcp = FastMCP(name="RappelConso", lifespan=_lifespan)
+
+
+# Compiled once at import. A single alternation scans the clause in one pass: a single-quoted
+# literal (including doubled single quotes) is consumed whole, so identifiers inside values are
+# skipped; otherwise an identifier followed by an operator captures the field name (group 1).
+_WHERE_FIELD_RE = re.compile(
+    r"'(?:''|[^'])*'|\b([a-zA-Z_][a-zA-Z0-9_]*)\s*(?:LIKE\b|=|!=|<>|>=|<=|>|<|\bIN\b|\bIS\b)", re.I
+)
+
+
+def _extract_fields_from_where(where_str: str) -> set:
+    """Extract candidate field names from an Opendatasoft `where` string.
+
+    Strategy:
+    - Remove single-quoted string literals to avoid capturing words inside values.
+    - Find tokens that look like identifiers followed by an operator (LIKE, =, !=, <, >, IN, IS...).
+    - Return a set of identifier candidates (case-sensitive as dataset fields are).
+    """
+    if not where_str:
+        return set()
+    return {m.group(1) for m in _WHERE_FIELD_RE.finditer(where_str) if m.group(1)}
+
+
+# Validates a whole page of records in a single pydantic-core call.
+_RESULTS_ADAPTER = TypeAdapter(List[ResultEntry])
+
+# Facet fields of the dataset: exact-value filters on them go through `refine=<field>:"<value>"`
+# (served from the facet index) instead of a `LIKE` clause. `refine` only accepts facets.
+_REFINE_FIELDS = frozenset({"categorie_produit", "sous_categorie_produit", "nature_juridique_rappel"})
+_LIKE_WILDCARDS = ("%", "_")
+
+# ResultEntry field names, computed once at import (they never change at runtime).
+# Pydantic v2 deprecates __fields__; prefer model_fields when available.
+try:
+    _RESULT_FIELD_NAMES = tuple(ResultEntry.model_fields.keys())
+except AttributeError:
+    # Fallback for Pydantic v1 / older models
+    _RESULT_FIELD_NAMES = tuple(ResultEntry.__fields__.keys())  # type: ignore
+ALLOWED_FIELDS = frozenset(_RESULT_FIELD_NAMES)
+_ALLOWED_FIELDS_SAMPLE = sorted(ALLOWED_FIELDS)[:50]
+
+# Only request the columns ResultEntry binds instead of `select=*`: smaller payloads to
+# transfer, decode and validate.
+_SELECT_FIELDS = ",".join(_RESULT_FIELD_NAMES)
+
+
+def _extract_fields(r: Any) -> Optional[dict]:
+    """Return the fields of one Opendatasoft record (`record.fields`, top-level `fields`, or the flat v2.1 record)."""
+    # Exact type check and no `{}` default: this runs once per record on every page.
+    if type(r) is not dict:
+        return None
+    # Explore v2.1 `results` entries are flat: the entry itself is the fields mapping.
+    if "record" not in r and "fields" not in r:
+        return r
+    rec = r.get("record")
+    return (rec.get("fields") if type(rec) is dict else None) or r.get("fields")
+
+
+def _extract_fields_list(records: list) -> List[dict]:
+    """Collect the `fields` mapping of each Opendatasoft record, skipping entries without one."""
+    fields_list = [_extract_fields(r) for r in records]
+    return [f for f in fields_list if f and type(f) is dict]
+
+
+def _validate_records(fields_list: List[dict]) -> List[ResultEntry]:
+    """Validate all records at once; if the batch fails, retry one by one so bad records are just skipped."""
+    try:
+        return _RESULTS_ADAPTER.validate_python(fields_list)
+    except ValidationError:
+        results: List[ResultEntry] = []
+        for fields in fields_list:
+            try:
+                results.append(ResultEntry.model_validate(fields))
+            except ValidationError:
+                # If a single record doesn't match, skip it
+                continue
+        return results
+
+
+def _validate_and_dump(fields_list: List[dict]) -> List[dict]:
+    return _RESULTS_ADAPTER.dump_python(_validate_records(fields_list), mode="json")
+
+
+# Below this many records the thread hop costs more than the validation it would offload.
+_THREAD_OFFLOAD_MIN_RECORDS = 20
+
+
+async def _normalize_records(records: list) -> List[dict]:
+    """Validate and serialize records, in a worker thread for large pages so the event loop keeps serving other calls."""
+    fields_list = _extract_fields_list(records)
+    if len(fields_list) < _THREAD_OFFLOAD_MIN_RECORDS:
+        return _validate_and_dump(fields_list)
+    return await asyncio.to_thread(_validate_and_dump, fields_list)
+
+
+def _build_rappels_params(
+    limit: int,
+    order_by: Optional[str],
+    where: Optional[str],
+    filters: Optional[Dict[str, str]],
+    select_all: bool,
+) -> Tuple[Dict[str, Any], Optional[dict]]:
+    """Build the Opendatasoft query for get_rappels_conso; the second item is an error payload when `where` is rejected."""
+    # Préparer les paramètres de la requête (les paramètres absents ne sont pas envoyés à l'API)
+    params: Dict[str, Any] = {
+        "limit": limit,
+        "select": "*" if select_all else _SELECT_FIELDS,
+    }
+    if order_by is not None:
+        params["order_by"] = order_by
+
+    # Build WHERE clause from `where` or `filters` if provided.
+    # Validate filter keys against ResultEntry fields (ALLOWED_FIELDS) to avoid sending invalid field names.
+    where_clauses: List[str] = []
+
+    # Accept raw where string as-is (backwards compatible), but validate referenced fields
+    if where:
+        cited = _extract_fields_from_where(where)
+        if cited:
+            invalid = sorted(cited - ALLOWED_FIELDS)
+            logging.debug("Champs autorisés dans 'where': %s", ALLOWED_FIELDS)
+            if invalid:
+                # Return a structured error so callers (and the LLM) are forced to use valid fields
+                logging.warning(f"Rejet du paramètre 'where': champs inconnus détectés: {invalid}")
+                return params, {
+                    "error": "Invalid field(s) in 'where'",
+                    "invalid_fields": invalid,
+                    "allowed_fields_sample": _ALLOWED_FIELDS_SAMPLE,
+                    "message": "Use only fields present in ResultEntry when building 'where' (or use the 'filters' dict with exact field names).",
+                }
+        else:
+            # If we couldn't heuristically extract any field, accept but log a warning
+            logging.warning("Aucun champ détecté dans 'where' par l'extracteur heuristique; envoi tel quel à l'API.")
+        where_clauses.append(where)
+
+    refines: List[str] = []
+
+    # If filters dict is provided, validate and build opendatasoft `refine` / WHERE fragments
+    if filters:
+        # Do NOT perform any legacy mapping here: the caller must use real dataset field names (e.g. 'libelle')
+        unknown = filters.keys() - ALLOWED_FIELDS
+        if unknown:
+            logging.warning(f"Ignorer les filtres inconnus: {sorted(unknown)}")
+        for key, value in filters.items():
+            if key in unknown:
+                continue
+            value = str(value)
+            # Exact match on a facet: use the indexed `refine` parameter rather than a LIKE scan.
+            if key in _REFINE_FIELDS and not any(c in value for c in _LIKE_WILDCARDS):
+                safe_value = value.replace('"', '\\"')
+                refines.append(f'{key}:"{safe_value}"')
+                continue
+            # Basic safe quoting for single quotes inside value
+            safe_value = value.replace("'", "''")
+            clause = f"{key} LIKE '{safe_value}'"
+            where_clauses.append(clause)
+
+    if where_clauses:
+        params["where"] = " AND ".join(where_clauses)
+    if refines:
+        params["refine"] = refines
+
+    return params, None
+
+
+# 3. Créer un outil spécifique pour ce dataset
+@mcp.tool
+async def get_rappels_conso(
+    limit: int = 20,
+    order_by: Optional[str] = None,
+    where: Optional[str] = None,
+    filters: Optional[Dict[str, str]] = None,
+    select_all: bool = False,
+) -> dict:
+    """
+    Récupère les rappels de produits du dataset 'rappelconso-v2-gtin-trie'.
+
+    Args:
+        limit: Le nombre maximum de rappels à retourner. (Défaut: 20)
+        order_by: Le champ sur lequel trier les résultats (ex: "date_publication desc").
+        where: Une requête de filtre Opendatasoft (ex: "libelle LIKE 'chocolat'").
+        filters: Filtres {champ: valeur} sur les champs de ResultEntry. Une valeur sans joker (%, _) sur une
+            facette (ex: categorie_produit) est envoyée en `refine`, sinon en clause `LIKE`.
+        select_all: Demander toutes les colonnes du dataset (`select=*`) au lieu des seuls champs de ResultEntry. (Défaut: False)
+    """
+    logging.info(f"Appel de l'outil get_rappels_conso avec limit={limit}, order_by={order_by}, where={where}, filters={filters}, select_all={select_all}")
+
+    params, error = _build_rappels_params(limit, order_by, where, filters, select_all)
+    if error is not None:
+        return error
+
+    data = await _call_api(params)
+    if "error" in data:
+        return data
+
+    # Retourner les données JSON. Try to normalize into ResultEntry records when possible.
+    try:
+        # Incoming structure from opendatasoft: { "records": [ { "record": { "fields": { ... } } }, ... }
+        # We'll extract fields into ResultEntry list if present.
+        records = data.get("records")
+        if isinstance(records, list):
+            results = await _normalize_records(records)
+            if results:
+                return {"total_count": len(results), "results": results}
+    except Exception:
+        # If normalization fails, fall back to raw response
+        pass
+
+    return data
+
+
+@mcp.tool
+async def get_rappels_conso_raw(
+    limit: int = 20,
+    order_by: Optional[str] = None,
+    where: Optional[str] = None,
+    filters: Optional[Dict[str, str]] = None,
+    select_all: bool = False,
+) -> dict:
+    """
+    Comme get_rappels_conso, mais renvoie la réponse JSON brute de l'API (champ "raw", texte) sans
+    décodage ni normalisation en ResultEntry. Plus rapide quand la normalisation n'est pas utile.
+
+    Args:
+        limit: Le nombre maximum de rappels à retourner. (Défaut: 20)
+        order_by: Le champ sur lequel trier les résultats (ex: "date_publication desc").
+        where: Une requête de filtre Opendatasoft (ex: "libelle LIKE 'chocolat'").
+        filters: Filtres {champ: valeur} sur les champs de ResultEntry (voir get_rappels_conso).
+        select_all: Demander toutes les colonnes du dataset (`select=*`). (Défaut: False)
+    """
+    params, error = _build_rappels_params(limit, order_by, where, filters, select_all)
+    if error is not None:
+        return error
+    return await _fetch_raw(params)
+
+
+# Upstream requests currently in flight, keyed by (endpoint, params). Concurrent identical
+# calls await the same task instead of each issuing its own GET (single-flight).
+_inflight: Dict[Tuple[str, frozenset], "asyncio.Task[dict]"] = {}
+
+# Last ETag and decoded body per request, so repeated queries are revalidated with
+# If-None-Match and a 304 reuses the stored body instead of downloading it again.
+_ETAG_CACHE_MAX = 256
+_etag_cache: Dict[Tuple[str, frozenset], Tuple[str, dict]] = {}
+
+
+def _request_key(params: Dict[str, Any]) -> Tuple[str, frozenset]:
+    # Repeated parameters (e.g. several `refine`) are lists; make them hashable for the key.
+    return (BASE_API_URL, frozenset((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items()))
+
+
+# Helper function to call the API
+async def _call_api(params: Dict[str, Any]) -> dict:
+    key = _request_key(params)
+    task = _inflight.get(key)
+    if task is None:
+        # No await between the lookup and the insert, so this is race-free on the event loop.
+        task = asyncio.ensure_future(_fetch(key, params))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: a cancelled caller must not cancel the request shared with the others.
+    return await asyncio.shield(task)
+
+
+async def _fetch(key: Tuple[str, frozenset], params: Dict[str, Any]) -> dict:
+    try:
+        cached = _etag_cache.get(key)
+        headers = {"If-None-Match": cached[0]} if cached is not None else None
+        response = await _get_client().get(BASE_API_URL, params=params, headers=headers)
+        # Debug: afficher l'URL finale et le statut
+        logging.info(f"Requête GET: {response.url} -> {response.status_code}")
+        logging.debug(f"Version HTTP négociée: {response.http_version}")
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        # Lève une erreur si le statut de la réponse est 4xx ou 5xx
+        response.raise_for_status()
+        data = decode_json(response)
+        etag = response.headers.get("ETag")
+        if etag:
+            _etag_cache.pop(key, None)
+            if len(_etag_cache) >= _ETAG_CACHE_MAX:
+                # Evict the oldest entry (dicts keep insertion order).
+                del _etag_cache[next(iter(_etag_cache))]
+            _etag_cache[key] = (etag, data)
+        return data
+    except Exception as e:
+        return _error_payload(e)
+
+
+async def _fetch_raw(params: Dict[str, Any]) -> dict:
+    """GET without decoding: the JSON text is handed to the caller as-is."""
+    try:
+        response = await _get_client().get(BASE_API_URL, params=params)
+        logging.info(f"Requête GET: {response.url} -> {response.status_code}")
+        response.raise_for_status()
+        return {"raw": response.text}
+    except Exception as e:
+        return _error_payload(e)
+
+
+def _error_payload(e: Exception) -> dict:
+    if isinstance(e, httpx.HTTPStatusError):
+        # Erreur HTTP (4xx/5xx) renvoyée par raise_for_status()
+        resp = e.response
+        logging.error(f"Erreur HTTP {resp.status_code} pour {resp.url}: {resp.text}")
+        return {"error": "HTTP error", "status_code": resp.status_code, "text": resp.text}
+    if isinstance(e, httpx.RequestError):
+        # Erreurs de transport / connexion
+        logging.error(f"Erreur lors de l'appel API: {e}")
+        return {"error": f"Erreur lors de l'appel à l'API: {e}"}
+    logging.error(f"Erreur inattendue: {e}")
+    return {"error": f"Erreur inattendue: {e}"}
+
+
+# In-memory TTL cache for slow-changing upstream data: {key: (expires_at, value)}.
+# The facets only move when Opendatasoft publishes new rappels (hours-to-days cadence).
+CATEGORIES_TTL = 900.0
+LATEST_RAPPELS_TTL = 60.0
+_cache: Dict[Any, Tuple[float, dict]] = {}
+
+
+async def _cached(key: Any, ttl: float, fetch: Callable[[], Awaitable[dict]], refresh: bool = False) -> dict:
+    """Return the cached value for `key` if still fresh, otherwise call `fetch` and cache its result.
+
+    Error payloads are never cached so a transient upstream failure is retried on the next call.
+    """
+    if not refresh:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+    value = await fetch()
+    if "error" not in value:
+        _cache[key] = (time.monotonic() + ttl, value)
+    return value
+
+
+def _parse_categories(data: dict) -> Optional[List[Dict[str, Any]]]:
+    """Extract [{name, count}] from the `categorie_produit` facet of a response, or None if absent."""
+    facets = data.get("facets", [])
+    for f in facets:
+        if f.get("name") == "categorie_produit":
+            # Interned: the same few category names come back on every call, so the cached
+            # results share one copy of each instead of a fresh string per response.
+            return [{"name": sys.intern(facet["name"]), "count": facet["count"]} for facet in f.get("facets", [])]
+    return None
+
+
+# C-level key function for max() over the facet entries.
+_BY_COUNT = itemgetter("count")
+
+
+async def _fetch_categories_with_counts() -> dict:
+    params = {"facet": "categorie_produit", "limit": 0}
+    data = await _call_api(params)
+    categories = _parse_categories(data)
+    if categories is not None:
+        return {"categories": categories}
+    return {"error": "No facets found"}
+
+
+async def _get_categories_with_counts(refresh: bool = False) -> dict:
+    return await _cached("categories", CATEGORIES_TTL, _fetch_categories_with_counts, refresh)
+
+
+@mcp.tool
+async def get_latest_rappels(limit: int = 100, refresh: bool = False) -> dict:
+    """
+    Récupère les derniers rappels de produits par date de publication (les plus récents en premier).
+
+    Args:
+        limit: Le nombre maximum de rappels à retourner. (Défaut: 100)
+        refresh: Ignorer le cache (60s) et interroger l'API directement. (Défaut: False)
+    """
+    return await _cached(("latest_rappels", limit), LATEST_RAPPELS_TTL, lambda: _fetch_latest_rappels(limit), refresh)
+
+
+async def _fetch_latest_rappels(limit: int) -> dict:
+    params = {"limit": limit, "order_by": "date_publication desc", "select": _SELECT_FIELDS}
+    data = await _call_api(params)
+
+    # Lazy %-formatting: the full payload is only rendered when debug logging is enabled.
+    logging.debug("data=%s", data)
+
+    # 1) Opendatasoft-style response: top-level "records" list
+    records = data.get("results") if isinstance(data, dict) else None
+    if isinstance(records, list):
+        results = await _normalize_records(records)
+        total = data.get("total_count", len(results)) if isinstance(data, dict) else len(results)
+        return {"total_count": total, "results": results}
+
+    # 4) As a last resort, return the raw API response so callers can inspect it
+    return data
+
+
+@mcp.tool
+async def get_categories_with_counts(refresh: bool = False) -> dict:
+    """
+    Récupère les catégories de produits avec le nombre d'occurrences (rappels par catégorie).
+
+    Args:
+        refresh: Ignorer le cache (15 min) et interroger l'API directement. (Défaut: False)
+    """
+    return await _get_categories_with_counts(refresh)
+
+
+@mcp.tool
+async def get_most_represented_category(refresh: bool = False) -> dict:
+    """
+    Récupère la catégorie de produits la plus représentée (avec le plus de rappels).
+
+    Args:
+        refresh: Ignorer le cache (15 min) et interroger l'API directement. (Défaut: False)
+    """
+    counts_data = await _get_categories_with_counts(refresh)
+    if "categories" in counts_data:
+        categories = counts_data["categories"]
+        if categories:
+            most = max(categories, key=_BY_COUNT)
+            return {"category": most["name"], "count": most["count"]}
+    return counts_data
+
+
+@mcp.tool
+async def get_latest_from_category(category: str, limit: int = 10) -> dict:
+    """
+    Récupère les derniers rappels d'une catégorie spécifique par date de publication.
+
+    Args:
+        category: La catégorie de produit (ex: "alimentation").
+        limit: Le nombre maximum de rappels à retourner. (Défaut: 10)
+    """
+    safe_category = category.replace("'", "''")
+    where = f"categorie_produit = '{safe_category}'"
+    params = {"limit": limit, "order_by": "date_publication desc", "select": _SELECT_FIELDS, "where": where}
+    data = await _call_api(params)
+    records = data.get("records", [])
+    results = await _normalize_records(records)
+    return {"total_count": len(results), "results": results}
+
+
+@mcp.tool
+async def get_top_category_with_latest(limit: int = 10) -> dict:
+    """
+    Récupère en un seul appel API la catégorie la plus représentée et ses rappels les plus récents.
+
+    Les rappels retournés sont ceux de cette catégorie parmi les `limit` derniers rappels publiés
+    (toutes catégories confondues); utiliser get_latest_from_category pour une liste exhaustive.
+
+    Args:
+        limit: Le nombre de derniers rappels à examiner. (Défaut: 10)
+    """
+    # Facets and the latest records come back from the same GET: one round-trip instead of two.
+    params = {"facet": "categorie_produit", "limit": limit, "order_by": "date_publication desc", "select": _SELECT_FIELDS}
+    data = await _call_api(params)
+    if "error" in data:
+        return data
+    categories = _parse_categories(data)
+    if not categories:
+        return {"error": "No facets found"}
+    most = max(categories, key=_BY_COUNT)
+    records = data.get("results")
+    results = await _normalize_records(records) if isinstance(records, list) else []
+    results = [r for r in results if r["categorie_produit"] == most["name"]]
+    return {"category": most["name"], "count": most["count"], "total_count": len(results), "results": results}
+
+
+@mcp.prompt
+def chercher_rappel_produit(nom_produit: str) -> str:
+    """
+    Génère un message pour rechercher un rappel de produit par son nom.
+    """
+    return f"Y a-t-il eu des rappels pour le produit libellé '{nom_produit}'?"
+
+
+# Stateless so any gunicorn worker can serve any request (MCP sessions are not shared across processes).
+app = mcp.http_app(stateless_http=True)
+
+# 4. Rendre le serveur exécutable (pour les tests)
+if __name__ == "__main__":
+    logging.error("Serveur RappelConso démarré pour test sur http://127.0.0.1:8000")
+    # uvloop + httptools (fournis par uvicorn[standard]) plutôt que la boucle asyncio et le parseur
+    # HTTP en pur Python (uvloop n'existe pas sous Windows: boucle asyncio dans ce cas); l'access log
+    # est coupé car il coûte plus cher que les petites réponses JSON.
+    uvicorn.run(app, host="127.0.0.1", port=8000,
+                loop="asyncio" if sys.platform == "win32" else "uvloop", http="httptools",
+                log_level="warning", access_log=False)
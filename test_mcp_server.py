@@ -5,48 +5,108 @@ This module contains tests to verify that the MCP server is properly configured
 and that all tools and prompts are available and functional.
 """
 
-import pytest
-import sys
-from unittest.mock import AsyncMock, Mock, patch
 import asyncio
+import copy
+import gzip
+import httpx
+import orjson
+import pytest
+import pytest_asyncio
+import socket
+import time
+from fastmcp import Client
+from fastmcp.exceptions import NotFoundError, ToolError
+from http_backend import AiohttpTransport
+from pathlib import Path
+from types import SimpleNamespace
+
 
-# Import from the server module (with hyphen replaced by underscore for Python import)
-import importlib.util
-import os
+# Facet payload shared by the category tools' tests
+CATEGORY_FACETS = {
+    "facets": [
+        {
+            "name": "categorie_produit",
+            "facets": [
+                {"name": "Alimentation", "count": 100},
+                {"name": "Véhicules", "count": 50}
+            ]
+        }
+    ]
+}
 
-# Load the server-rappel.py module dynamically
-spec = importlib.util.spec_from_file_location(
-    "server_rappel",
-    os.path.join(os.path.dirname(__file__), "server-rappel.py")
-)
-server_rappel = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(server_rappel)
+# Real Explore v2.1 records (flat `results` entries), all in the "alimentation" category
+EXAMPLE_RESULTS = orjson.loads((Path(__file__).parent / "example.json").read_bytes())["results"]
 
-# Import the MCP server
-mcp = server_rappel.mcp
+# Minimal swagger document shaped like the tabular API's, including its invalid
+# `additionalProperties: {"type": "any"}` (on `record`, its `Reference` part, and nested deeper)
+SAMPLE_SPEC = {
+    "openapi": "3.0.3",
+    "info": {"title": "Rappel Conso", "version": "1.0"},
+    "servers": [{"url": "https://tabular-api.test"}],
+    "paths": {
+        "/api/resources/data/": {
+            "get": {
+                "operationId": "list_records",
+                "description": "Liste les enregistrements du jeu de données.",
+                "parameters": [
+                    {"name": "page_size", "in": "query", "schema": {"type": "integer"}},
+                    {"name": "sort", "in": "query", "schema": {"type": "string", "default": "id__asc"}}
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OK",
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": "#/components/schemas/record"}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    "components": {
+        "schemas": {
+            "record": {
+                "type": "object",
+                "additionalProperties": {"type": "any"},
+                "Reference": {"type": "object", "additionalProperties": {"type": "any"}}
+            },
+            "page": {
+                "type": "object",
+                "properties": {
+                    "data": {
+                        "type": "array",
+                        "items": {"anyOf": [{"type": "object", "additionalProperties": {"type": "any"}}]}
+                    },
+                    "ratio": {"type": "number", "example": 0.5}
+                }
+            }
+        }
+    }
+}
 
 
 class TestMCPServerConfiguration:
     """Test the MCP server initialization and configuration."""
     
-    def test_mcp_server_exists(self):
+    def test_mcp_server_exists(self, mcp_server):
         """Test that the MCP server instance exists."""
-        assert mcp is not None
+        assert mcp_server is not None
     
-    def test_mcp_server_name(self):
+    def test_mcp_server_name(self, mcp_server):
         """Test that the MCP server has the correct name."""
-        assert mcp.name == "RappelConso"
+        assert mcp_server.name == "RappelConso"
     
     @pytest.mark.asyncio
-    async def test_mcp_server_has_tools(self):
+    async def test_mcp_server_has_tools(self, tools):
         """Test that the MCP server has registered tools."""
-        tools = await mcp.get_tools()
         assert len(tools) > 0
     
     @pytest.mark.asyncio
-    async def test_mcp_server_has_prompts(self):
+    async def test_mcp_server_has_prompts(self, mcp_server):
         """Test that the MCP server has registered prompts."""
-        prompts = await mcp.get_prompts()
+        prompts = await mcp_server.get_prompts()
         assert len(prompts) > 0
 
 
@@ -54,46 +114,42 @@ class TestMCPTools:
     """Test the availability and structure of MCP tools."""
     
     @pytest.mark.asyncio
-    async def test_get_rappels_conso_tool_exists(self):
+    async def test_get_rappels_conso_tool_exists(self, tools):
         """Test that get_rappels_conso tool is registered."""
-        tools = await mcp.get_tools()
         assert "get_rappels_conso" in tools
     
     @pytest.mark.asyncio
-    async def test_get_latest_rappels_tool_exists(self):
+    async def test_get_latest_rappels_tool_exists(self, tools):
         """Test that get_latest_rappels tool is registered."""
-        tools = await mcp.get_tools()
         assert "get_latest_rappels" in tools
     
     @pytest.mark.asyncio
-    async def test_get_categories_with_counts_tool_exists(self):
+    async def test_get_categories_with_counts_tool_exists(self, tools):
         """Test that get_categories_with_counts tool is registered."""
-        tools = await mcp.get_tools()
         assert "get_categories_with_counts" in tools
     
     @pytest.mark.asyncio
-    async def test_get_most_represented_category_tool_exists(self):
+    async def test_get_most_represented_category_tool_exists(self, tools):
         """Test that get_most_represented_category tool is registered."""
-        tools = await mcp.get_tools()
         assert "get_most_represented_category" in tools
     
     @pytest.mark.asyncio
-    async def test_get_latest_from_category_tool_exists(self):
+    async def test_get_latest_from_category_tool_exists(self, tools):
         """Test that get_latest_from_category tool is registered."""
-        tools = await mcp.get_tools()
         assert "get_latest_from_category" in tools
     
     @pytest.mark.asyncio
-    async def test_all_expected_tools_are_available(self):
+    async def test_all_expected_tools_are_available(self, tools):
         """Test that all expected tools are available."""
-        tools = await mcp.get_tools()
         
         expected_tools = [
             "get_rappels_conso",
             "get_latest_rappels",
             "get_categories_with_counts",
             "get_most_represented_category",
-            "get_latest_from_category"
+            "get_latest_from_category",
+            "get_top_category_with_latest",
+            "get_rappels_conso_raw"
         ]
         
         for expected_tool in expected_tools:
@@ -104,15 +160,15 @@ class TestMCPPrompts:
     """Test the availability and structure of MCP prompts."""
     
     @pytest.mark.asyncio
-    async def test_chercher_rappel_produit_prompt_exists(self):
+    async def test_chercher_rappel_produit_prompt_exists(self, mcp_server):
         """Test that chercher_rappel_produit prompt is registered."""
-        prompts = await mcp.get_prompts()
+        prompts = await mcp_server.get_prompts()
         assert "chercher_rappel_produit" in prompts
     
     @pytest.mark.asyncio
-    async def test_chercher_rappel_produit_prompt_functionality(self):
+    async def test_chercher_rappel_produit_prompt_functionality(self, mcp_server):
         """Test that the prompt function works correctly."""
-        prompts = await mcp.get_prompts()
+        prompts = await mcp_server.get_prompts()
         prompt = prompts["chercher_rappel_produit"]
         # The prompt has a .fn attribute that is the actual function
         result = prompt.fn("chocolat")
@@ -125,56 +181,20 @@ class TestMCPPrompts:
 class TestToolFunctionality:
     """Test the functionality of individual tool functions with mocked API calls."""
     
-    @patch('httpx.AsyncClient')
-    async def test_get_rappels_conso_basic(self, mock_client_class):
+    async def test_get_rappels_conso_basic(self, http_mock, tools):
         """Test get_rappels_conso with basic parameters."""
-        # Mock the httpx.AsyncClient
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "total_count": 1,
-            "records": []
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
-        
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
+        http_mock({"total_count": 1, "records": []})
         
-        mock_client_class.return_value = mock_client
-        
-        tools = await mcp.get_tools()
-        get_rappels_conso_fn = tools["get_rappels_conso"].fn
-        result = await get_rappels_conso_fn(limit=10)
+        result = await tools["get_rappels_conso"].fn(limit=10)
         
         assert isinstance(result, dict)
         assert "total_count" in result or "records" in result or "error" not in result
     
-    @patch('httpx.AsyncClient')
-    async def test_get_rappels_conso_with_filters(self, mock_client_class):
+    async def test_get_rappels_conso_with_filters(self, http_mock, tools):
         """Test get_rappels_conso with filter parameters."""
-        # Mock the httpx.AsyncClient
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "total_count": 0,
-            "records": []
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
-        
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
-        
-        mock_client_class.return_value = mock_client
+        http_mock({"total_count": 0, "records": []})
         
-        tools = await mcp.get_tools()
-        get_rappels_conso_fn = tools["get_rappels_conso"].fn
-        result = await get_rappels_conso_fn(
+        result = await tools["get_rappels_conso"].fn(
             limit=5,
             order_by="date_publication desc",
             filters={"libelle": "chocolat"}
@@ -182,30 +202,25 @@ class TestToolFunctionality:
         
         assert isinstance(result, dict)
     
-    @patch('httpx.AsyncClient')
-    async def test_get_rappels_conso_with_invalid_field(self, mock_client_class):
-        """Test get_rappels_conso with invalid filter field."""
-        # Mock the httpx.AsyncClient even though it won't be called
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "total_count": 0,
-            "records": []
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
+    async def test_get_rappels_conso_facet_filter_uses_refine(self, http_mock, tools):
+        """Test that exact filters on facet fields are sent as refine, others as LIKE."""
+        requests = http_mock({"total_count": 0, "records": []})
         
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
+        await tools["get_rappels_conso"].fn(
+            limit=5,
+            filters={"categorie_produit": "alimentation", "libelle": "choco%"}
+        )
         
-        mock_client_class.return_value = mock_client
+        params = requests[0].url.params
+        assert params.get_list("refine") == ['categorie_produit:"alimentation"']
+        assert params["where"] == "libelle LIKE 'choco%'"
+    
+    async def test_get_rappels_conso_with_invalid_field(self, http_mock, tools):
+        """Test get_rappels_conso with invalid filter field."""
+        http_mock({"total_count": 0, "records": []})
         
         # The function should reject invalid fields before making the API call
-        tools = await mcp.get_tools()
-        get_rappels_conso_fn = tools["get_rappels_conso"].fn
-        result = await get_rappels_conso_fn(
+        result = await tools["get_rappels_conso"].fn(
             limit=5,
             filters={"invalid_field_name": "value"}
         )
@@ -213,163 +228,200 @@ class TestToolFunctionality:
         assert isinstance(result, dict)
         # The function should either succeed without the invalid filter or return without error
     
-    @patch('httpx.AsyncClient')
-    async def test_get_latest_rappels(self, mock_client_class):
+    async def test_get_latest_rappels(self, http_mock, tools):
         """Test get_latest_rappels function."""
-        # Mock the httpx.AsyncClient
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "total_count": 0,
-            "results": []
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
-        
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
-        
-        mock_client_class.return_value = mock_client
+        http_mock({"total_count": 0, "results": []})
         
-        tools = await mcp.get_tools()
-        get_latest_rappels_fn = tools["get_latest_rappels"].fn
-        result = await get_latest_rappels_fn(limit=50)
+        result = await tools["get_latest_rappels"].fn(limit=50)
         
         assert isinstance(result, dict)
         assert "total_count" in result or "results" in result or "error" not in result
     
-    @patch('httpx.AsyncClient')
-    async def test_get_categories_with_counts(self, mock_client_class):
+    async def test_get_categories_with_counts(self, http_mock, tools):
         """Test get_categories_with_counts function."""
-        # Mock the httpx.AsyncClient
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "facets": [
-                {
-                    "name": "categorie_produit",
-                    "facets": [
-                        {"name": "Alimentation", "count": 100},
-                        {"name": "Véhicules", "count": 50}
-                    ]
-                }
-            ]
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
+        http_mock(CATEGORY_FACETS)
         
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
-        
-        mock_client_class.return_value = mock_client
-        
-        tools = await mcp.get_tools()
-        get_categories_with_counts_fn = tools["get_categories_with_counts"].fn
-        result = await get_categories_with_counts_fn()
+        result = await tools["get_categories_with_counts"].fn()
         
         assert isinstance(result, dict)
         assert "categories" in result or "error" in result
     
-    @patch('httpx.AsyncClient')
-    async def test_get_most_represented_category(self, mock_client_class):
+    async def test_get_most_represented_category(self, http_mock, tools):
         """Test get_most_represented_category function."""
-        # Mock the httpx.AsyncClient
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
+        http_mock(CATEGORY_FACETS)
+        
+        result = await tools["get_most_represented_category"].fn()
+        
+        assert isinstance(result, dict)
+        if "category" in result:
+            assert "count" in result
+            assert result["category"] == "Alimentation"
+            assert result["count"] == 100
+    
+    async def test_get_latest_from_category(self, http_mock, tools):
+        """Test get_latest_from_category function."""
+        http_mock({"records": []})
+        
+        result = await tools["get_latest_from_category"].fn("Alimentation", limit=10)
+        
+        assert isinstance(result, dict)
+        assert "total_count" in result and "results" in result
+
+    async def test_get_top_category_with_latest(self, http_mock, tools):
+        """Test get_top_category_with_latest reads facets and records from one response."""
+        other = {**EXAMPLE_RESULTS[0], "id": 0, "categorie_produit": "hygiène-beauté"}
+        requests = http_mock({
             "facets": [
                 {
                     "name": "categorie_produit",
                     "facets": [
-                        {"name": "Alimentation", "count": 100},
-                        {"name": "Véhicules", "count": 50}
+                        {"name": "alimentation", "count": 100},
+                        {"name": "hygiène-beauté", "count": 50}
                     ]
                 }
-            ]
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
+            ],
+            "results": [other, *EXAMPLE_RESULTS]
+        })
         
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
+        result = await tools["get_top_category_with_latest"].fn(limit=len(EXAMPLE_RESULTS) + 1)
         
-        mock_client_class.return_value = mock_client
+        assert len(requests) == 1
+        assert result["category"] == "alimentation"
+        assert result["count"] == 100
+        assert result["total_count"] == len(EXAMPLE_RESULTS)
+        assert [r["numero_fiche"] for r in result["results"]] == [r["numero_fiche"] for r in EXAMPLE_RESULTS]
+
+    async def test_etag_revalidation_reuses_cached_body(self, http_mock, tools):
+        """Test that a repeated query sends If-None-Match and a 304 returns the stored body."""
+        requests = http_mock(
+            httpx.Response(200, json={"total_count": 3, "records": []}, headers={"ETag": '"v1"'}),
+            httpx.Response(304),
+        )
         
-        tools = await mcp.get_tools()
-        get_most_represented_category_fn = tools["get_most_represented_category"].fn
-        result = await get_most_represented_category_fn()
+        get_rappels_conso_fn = tools["get_rappels_conso"].fn
+        first = await get_rappels_conso_fn(limit=3)
+        second = await get_rappels_conso_fn(limit=3)
         
-        assert isinstance(result, dict)
-        if "category" in result:
-            assert "count" in result
-            assert result["category"] == "Alimentation"
-            assert result["count"] == 100
-    
-    @patch('httpx.AsyncClient')
-    async def test_get_latest_from_category(self, mock_client_class):
-        """Test get_latest_from_category function."""
-        # Mock the httpx.AsyncClient
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "records": []
-        }
-        mock_response.raise_for_status = Mock()
-        mock_response.url = "https://test.url"
+        assert second == first == {"total_count": 3, "records": []}
+        assert "If-None-Match" not in requests[0].headers
+        assert requests[1].headers["If-None-Match"] == '"v1"'
+
+    async def test_categories_are_cached(self, http_mock, tools):
+        """Test that a second call within the TTL is served from the cache."""
+        requests = http_mock(CATEGORY_FACETS)
+        get_categories_with_counts_fn = tools["get_categories_with_counts"].fn
         
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
+        first = await get_categories_with_counts_fn()
+        second = await get_categories_with_counts_fn()
         
-        mock_client_class.return_value = mock_client
+        assert second == first
+        assert len(requests) == 1
+
+    async def test_refresh_bypasses_cache(self, http_mock, tools):
+        """Test that refresh=True queries the API even when a fresh entry is cached."""
+        requests = http_mock(CATEGORY_FACETS)
+        get_categories_with_counts_fn = tools["get_categories_with_counts"].fn
         
-        tools = await mcp.get_tools()
-        get_latest_from_category_fn = tools["get_latest_from_category"].fn
-        result = await get_latest_from_category_fn("Alimentation", limit=10)
+        await get_categories_with_counts_fn()
+        await get_categories_with_counts_fn(refresh=True)
         
-        assert isinstance(result, dict)
-        assert "total_count" in result and "results" in result
+        assert len(requests) == 2
+
+    async def test_error_payload_is_not_cached(self, http_mock, tools):
+        """Test that an upstream failure is retried on the next call instead of being cached."""
+        requests = http_mock(httpx.Response(503), CATEGORY_FACETS)
+        get_categories_with_counts_fn = tools["get_categories_with_counts"].fn
+        
+        failed = await get_categories_with_counts_fn()
+        recovered = await get_categories_with_counts_fn()
+        
+        assert "error" in failed
+        assert recovered["categories"][0] == {"name": "Alimentation", "count": 100}
+        assert len(requests) == 2
+
+    async def test_concurrent_identical_calls_share_one_request(self, http_mock, server_rappel, tools):
+        """Test that identical concurrent calls are answered by a single upstream GET (single-flight)."""
+        async def slow(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"total_count": 0, "results": []})
+        requests = http_mock(slow)
+        
+        results = await asyncio.gather(*(tools["get_latest_rappels"].fn(limit=5) for _ in range(5)))
+        
+        assert len(requests) == 1
+        assert all(r == {"total_count": 0, "results": []} for r in results)
+        assert server_rappel._inflight == {}
+
+    async def test_cancelled_caller_does_not_cancel_shared_request(self, http_mock, server_rappel, tools):
+        """Test that cancelling one waiting caller leaves the shared request running for the others."""
+        async def slow(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"total_count": 0, "results": []})
+        requests = http_mock(slow)
+        get_latest_rappels_fn = tools["get_latest_rappels"].fn
+        
+        cancelled = asyncio.ensure_future(get_latest_rappels_fn(limit=5))
+        waiting = asyncio.ensure_future(get_latest_rappels_fn(limit=5))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        
+        assert await waiting == {"total_count": 0, "results": []}
+        assert cancelled.cancelled()
+        assert len(requests) == 1
+        assert server_rappel._inflight == {}
+
+    async def test_get_rappels_conso_raw_returns_text(self, http_mock, tools):
+        """Test get_rappels_conso_raw passes the JSON text through without decoding it."""
+        http_mock(httpx.Response(200, text='{"total_count": 0, "results": []}'))
+        
+        result = await tools["get_rappels_conso_raw"].fn(limit=5)
+        
+        assert result == {"raw": '{"total_count": 0, "results": []}'}
+
+
+class TestWhereFieldExtraction:
+    """Test the heuristic field extractor used to validate 'where' clauses."""
+
+    def test_extract_fields_ignores_string_literals(self, server_rappel):
+        """Test that identifiers inside quoted values are not reported as fields."""
+        fields = server_rappel._extract_fields_from_where(
+            "libelle LIKE 'marque = test' AND categorie_produit = 'l''alimentation'"
+        )
+        assert fields == {"libelle", "categorie_produit"}
+
+    def test_extract_fields_empty_where(self, server_rappel):
+        """Test that an empty clause yields no fields."""
+        assert server_rappel._extract_fields_from_where("") == set()
 
 
 class TestErrorHandling:
     """Test error handling in the MCP tools."""
     
     @pytest.mark.asyncio
-    @patch('httpx.AsyncClient')
-    async def test_get_rappels_conso_http_error(self, mock_client_class):
+    async def test_get_rappels_conso_http_error(self, server_rappel, monkeypatch, tools):
         """Test get_rappels_conso handles HTTP errors gracefully."""
-        import httpx
-        
-        # Mock the httpx.AsyncClient to raise an HTTP error
-        mock_response = Mock()
-        mock_response.status_code = 404
-        mock_response.text = "Not Found"
-        mock_response.url = "https://test.url"
-        
+        # A plain response object whose raise_for_status raises an HTTP error
         def raise_error():
             raise httpx.HTTPStatusError(
                 "404 Not Found",
-                request=Mock(),
+                request=httpx.Request("GET", mock_response.url),
                 response=mock_response
             )
         
-        mock_response.raise_for_status = raise_error
+        mock_response = SimpleNamespace(
+            status_code=404,
+            text="Not Found",
+            url="https://test.url",
+            http_version="HTTP/1.1",
+            headers={},
+            raise_for_status=raise_error,
+        )
         
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(return_value=mock_response)
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
+        async def get(*args, **kwargs):
+            return mock_response
         
-        mock_client_class.return_value = mock_client
+        monkeypatch.setattr(server_rappel, "_client", SimpleNamespace(get=get))
         
-        tools = await mcp.get_tools()
         get_rappels_conso_fn = tools["get_rappels_conso"].fn
         result = await get_rappels_conso_fn(limit=10)
         
@@ -379,22 +431,11 @@ class TestErrorHandling:
         assert result["status_code"] == 404
     
     @pytest.mark.asyncio
-    @patch('httpx.AsyncClient')
-    async def test_get_rappels_conso_request_error(self, mock_client_class):
+    async def test_get_rappels_conso_request_error(self, http_mock, tools):
         """Test get_rappels_conso handles request errors gracefully."""
-        import httpx
-        
-        # Mock the httpx.AsyncClient to raise a request error
-        mock_client = AsyncMock()
-        mock_client.get = AsyncMock(
-            side_effect=httpx.RequestError("Connection failed")
-        )
-        mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-        mock_client.__aexit__ = AsyncMock(return_value=None)
-        
-        mock_client_class.return_value = mock_client
+        # The mock transport raises a connection error instead of answering
+        http_mock(httpx.ConnectError("Connection failed"))
         
-        tools = await mcp.get_tools()
         get_rappels_conso_fn = tools["get_rappels_conso"].fn
         result = await get_rappels_conso_fn(limit=10)
         
@@ -402,6 +443,352 @@ class TestErrorHandling:
         assert "error" in result
 
 
+def _patch_recursively(node):
+    """Reference recursive version of server.patch_spec, for comparison."""
+    if isinstance(node, dict):
+        ap = node.get("additionalProperties")
+        if isinstance(ap, dict) and ap.get("type") == "any":
+            node["additionalProperties"] = True
+        for value in node.values():
+            _patch_recursively(value)
+    elif isinstance(node, list):
+        for value in node:
+            _patch_recursively(value)
+
+
+class TestOpenAPISpecPatch:
+    """Test the in-memory fix of invalid 'additionalProperties' in server.py."""
+
+    def test_patch_spec_matches_recursive_patch(self, openapi_server):
+        """Test that the iterative walk produces the same spec as a recursive one."""
+        spec = copy.deepcopy(SAMPLE_SPEC)
+        expected = copy.deepcopy(SAMPLE_SPEC)
+        _patch_recursively(expected)
+        
+        openapi_server.patch_spec(spec)
+        
+        assert spec == expected
+        schemas = spec["components"]["schemas"]
+        assert schemas["record"]["additionalProperties"] is True
+        assert schemas["record"]["Reference"]["additionalProperties"] is True
+        assert schemas["page"]["properties"]["data"]["items"]["anyOf"][0]["additionalProperties"] is True
+
+    def test_patch_node_counts_and_keeps_valid_values(self, openapi_server):
+        """Test that only {"type": "any"} is replaced and the count is reported."""
+        node = {"a": {"additionalProperties": {"type": "string"}}, "b": [{"additionalProperties": {"type": "any"}}]}
+        
+        assert openapi_server._patch_node(node) == 1
+        assert node == {"a": {"additionalProperties": {"type": "string"}}, "b": [{"additionalProperties": True}]}
+
+
+class TestOpenAPIToolDescriptions:
+    """Test the trimming of generated OpenAPI tool descriptions in server.py."""
+
+    def test_trim_component_keeps_operation_description(self, openapi_server):
+        """Test that the appended parameter / response sections are dropped, with trailing whitespace."""
+        component = SimpleNamespace(
+            description="Liste les enregistrements.\n\n\n**Query Parameters:**\n- page_size\n\n**Responses:**\n- 200: OK"
+        )
+        
+        openapi_server._trim_component(None, component)
+        
+        assert component.description == "Liste les enregistrements."
+
+    def test_trim_component_keeps_bold_paragraphs(self, openapi_server):
+        """Test that a bold paragraph of the operation's own description is kept."""
+        component = SimpleNamespace(
+            description="Liste les enregistrements.\n\n**Attention:** pagination limitée.\n\n**Path Parameters:**\n- id"
+        )
+        
+        openapi_server._trim_component(None, component)
+        
+        assert component.description == "Liste les enregistrements.\n\n**Attention:** pagination limitée."
+
+    def test_trim_component_without_description(self, openapi_server):
+        """Test that components without a description are left alone."""
+        component = SimpleNamespace(description=None)
+        
+        openapi_server._trim_component(None, component)
+        
+        assert component.description is None
+
+    @pytest.mark.asyncio
+    async def test_generated_tools_are_trimmed(self, openapi_server):
+        """Test that tools built from the spec carry only the operation's own description."""
+        spec = copy.deepcopy(SAMPLE_SPEC)
+        openapi_server.patch_spec(spec)
+        
+        async with httpx.AsyncClient(base_url="https://tabular-api.test") as client:
+            server = openapi_server.FastMCP.from_openapi(
+                openapi_spec=spec, client=client, mcp_component_fn=openapi_server._trim_component
+            )
+            tools = await server.get_tools()
+        
+        assert tools["list_records"].description == "Liste les enregistrements du jeu de données."
+
+
+@pytest.mark.asyncio
+class TestArgumentValidation:
+    """Test the fastjsonschema pre-validation middleware of server.py."""
+
+    @pytest.fixture
+    def validated_server(self, openapi_server, mock_client):
+        """OpenAPI tools built from the sample spec, with ArgumentValidation and a mocked upstream API."""
+        if openapi_server.fastjsonschema is None:
+            pytest.skip("fastjsonschema is not installed")
+        api, requests = mock_client({"data": []}, base_url="https://tabular-api.test")
+        spec = copy.deepcopy(SAMPLE_SPEC)
+        openapi_server.patch_spec(spec)
+        server = openapi_server.FastMCP.from_openapi(openapi_spec=spec, client=api)
+        middleware = openapi_server.ArgumentValidation(server)
+        server.add_middleware(middleware)
+        return server, middleware, requests
+
+    async def test_rejects_bad_argument_type_without_upstream_call(self, validated_server):
+        """Test that an argument of the wrong type is rejected locally."""
+        server, _, requests = validated_server
+        
+        async with Client(server) as client:
+            with pytest.raises(ToolError, match="Invalid arguments for list_records"):
+                await client.call_tool("list_records", {"page_size": "beaucoup"})
+        
+        assert requests == []
+
+    async def test_valid_arguments_reach_upstream(self, validated_server):
+        """Test that valid arguments pass through to the API."""
+        server, _, requests = validated_server
+        
+        async with Client(server) as client:
+            await client.call_tool("list_records", {"page_size": 5})
+        
+        assert len(requests) == 1
+        assert requests[0].url.params["page_size"] == "5"
+
+    async def test_validation_does_not_fill_defaults(self, validated_server):
+        """Test that schema defaults are not written into the arguments sent upstream."""
+        server, _, requests = validated_server
+        
+        async with Client(server) as client:
+            await client.call_tool("list_records", {"page_size": 5})
+        
+        assert dict(requests[0].url.params) == {"page_size": "5"}
+
+    async def test_unknown_tool_is_not_cached(self, validated_server):
+        """Test that a client-chosen unknown tool name propagates NotFoundError and is not remembered."""
+        _, middleware, _ = validated_server
+        
+        with pytest.raises(NotFoundError):
+            await middleware._validator("list_recrods")
+        
+        assert "list_recrods" not in middleware._validators
+
+
+@pytest.mark.asyncio
+class TestOpenAPISpecCache:
+    """Test the on-disk cache and revalidation of the OpenAPI spec in server.py."""
+
+    async def test_cache_hit_skips_network(self, openapi_server, spec_cache, mock_client):
+        """Test that a cached spec is served without any request."""
+        (spec_cache / "swagger.json").write_bytes(orjson.dumps(SAMPLE_SPEC))
+        (spec_cache / "swagger.meta.json").write_bytes(orjson.dumps({"etag": '"v1"', "fetched_at": time.time()}))
+        client, requests = mock_client(httpx.Response(500))
+
+        spec, meta = await openapi_server.load_spec(client)
+
+        assert requests == []
+        assert spec == SAMPLE_SPEC
+        assert meta["etag"] == '"v1"'
+
+    async def test_cache_miss_fetches_and_writes_cache(self, openapi_server, spec_cache, mock_client):
+        """Test that without a cache the spec is fetched, patched and written with its validators."""
+        client, _ = mock_client(httpx.Response(200, content=orjson.dumps(SAMPLE_SPEC), headers={"ETag": '"v1"'}))
+
+        spec, meta = await openapi_server.load_spec(client)
+
+        assert spec["components"]["schemas"]["record"]["additionalProperties"] is True
+        assert orjson.loads((spec_cache / "swagger.json").read_bytes()) == spec
+        assert orjson.loads((spec_cache / "swagger.meta.json").read_bytes()) == meta
+        assert meta["etag"] == '"v1"'
+
+    async def test_revalidate_304_only_refreshes_meta(self, openapi_server, spec_cache, mock_client):
+        """Test that a 304 restarts the TTL without touching the cached spec."""
+        spec_bytes = orjson.dumps(SAMPLE_SPEC)
+        (spec_cache / "swagger.json").write_bytes(spec_bytes)
+        meta = {"etag": '"v1"', "last_modified": None, "fetched_at": 0}
+        client, requests = mock_client(httpx.Response(304))
+
+        await openapi_server._revalidate(client, meta)
+
+        assert requests[0].headers["If-None-Match"] == '"v1"'
+        assert "If-Modified-Since" not in requests[0].headers
+        assert (spec_cache / "swagger.json").read_bytes() == spec_bytes
+        new_meta = orjson.loads((spec_cache / "swagger.meta.json").read_bytes())
+        assert new_meta["etag"] == '"v1"'
+        assert new_meta["fetched_at"] > 0
+
+    async def test_revalidate_200_rewrites_patched_spec(self, openapi_server, spec_cache, mock_client):
+        """Test that a changed upstream spec is patched and replaces the cached copy."""
+        (spec_cache / "swagger.json").write_bytes(orjson.dumps({"openapi": "3.0.3"}))
+        changed = {**SAMPLE_SPEC, "info": {"title": "Rappel Conso", "version": "2.0"}}
+        client, _ = mock_client(httpx.Response(200, content=orjson.dumps(changed), headers={"ETag": '"v2"'}))
+
+        await openapi_server._revalidate(client, {"etag": '"v1"', "fetched_at": 0})
+
+        cached = orjson.loads((spec_cache / "swagger.json").read_bytes())
+        assert cached["info"]["version"] == "2.0"
+        assert cached["components"]["schemas"]["record"]["additionalProperties"] is True
+        assert orjson.loads((spec_cache / "swagger.meta.json").read_bytes())["etag"] == '"v2"'
+
+    async def test_revalidate_skips_fresh_spec(self, openapi_server, spec_cache, mock_client):
+        """Test that a spec younger than SPEC_TTL is not revalidated."""
+        client, requests = mock_client(httpx.Response(304))
+
+        await openapi_server._revalidate(client, {"etag": '"v1"', "fetched_at": time.time()})
+
+        assert requests == []
+
+
+@pytest.mark.asyncio
+class TestOpenAPILifespan:
+    """Test the mounting of the OpenAPI tools in server.py's lifespan."""
+
+    async def test_reentered_lifespan_does_not_stack_mounts(self, openapi_server, spec_cache):
+        """Test that each lifespan entry mounts the tools once and unmounts them on exit."""
+        (spec_cache / "swagger.json").write_bytes(orjson.dumps(SAMPLE_SPEC))
+        (spec_cache / "swagger.meta.json").write_bytes(orjson.dumps({"fetched_at": time.time()}))
+        mcp_openapi = openapi_server.mcp
+        
+        for _ in range(3):
+            async with openapi_server._lifespan(mcp_openapi):
+                assert len(mcp_openapi._mounted_servers) == 1
+                client = openapi_server.api_client
+                assert "list_records" in await mcp_openapi.get_tools()
+            assert client.is_closed
+        
+        assert mcp_openapi._mounted_servers == []
+        assert openapi_server.api_client is None
+
+    async def test_client_closed_when_tool_generation_fails(self, openapi_server, spec_cache, monkeypatch):
+        """Test that the client is closed if building the tools from the spec raises."""
+        (spec_cache / "swagger.json").write_bytes(orjson.dumps(SAMPLE_SPEC))
+        (spec_cache / "swagger.meta.json").write_bytes(orjson.dumps({"fetched_at": time.time()}))
+        clients = []
+
+        def broken_from_openapi(openapi_spec, client, **kwargs):
+            clients.append(client)
+            raise ValueError("bad spec")
+
+        monkeypatch.setattr(openapi_server.FastMCP, "from_openapi", broken_from_openapi)
+        
+        with pytest.raises(ValueError):
+            async with openapi_server._lifespan(openapi_server.mcp):
+                pass
+        
+        assert clients[0].is_closed
+        assert openapi_server.mcp._mounted_servers == []
+
+
+def _chunked(body, size=64):
+    """Serve a body as a stream of small chunks, like a real download."""
+    async def chunks():
+        for i in range(0, len(body), size):
+            yield body[i:i + size]
+    return chunks()
+
+
+@pytest.mark.asyncio
+class TestOpenAPISpecStreaming:
+    """Test the incremental (ijson) decoding of a freshly fetched spec in server.py."""
+
+    async def _fetch(self, openapi_server, spec_cache, mock_client):
+        body = orjson.dumps(SAMPLE_SPEC)
+        # A fresh streamed response per request: a chunk generator can only be read once
+        client, _ = mock_client(lambda request: httpx.Response(200, content=_chunked(body), headers={"ETag": '"v1"'}))
+
+        spec, _ = await openapi_server.load_spec(client)
+        # Empty the cache so the next load goes to the network again
+        for path in spec_cache.iterdir():
+            path.unlink()
+        return spec
+
+    async def test_ijson_and_orjson_paths_build_the_same_spec(self, openapi_server, spec_cache, mock_client, monkeypatch):
+        """Test that streaming with ijson yields the same patched spec as orjson + patch_spec."""
+        if openapi_server.ijson is None:
+            pytest.skip("ijson is not installed")
+        streamed = await self._fetch(openapi_server, spec_cache, mock_client)
+        monkeypatch.setattr(openapi_server, "ijson", None)
+        decoded = await self._fetch(openapi_server, spec_cache, mock_client)
+        
+        expected = copy.deepcopy(SAMPLE_SPEC)
+        _patch_recursively(expected)
+        assert streamed == decoded == expected
+        # Floats, not Decimal, so the spec can be written back with orjson
+        assert type(streamed["components"]["schemas"]["page"]["properties"]["ratio"]["example"]) is float
+
+    async def test_async_byte_reader_reads_across_chunks(self, openapi_server):
+        """Test that read(size) spans chunk boundaries and read() returns the rest."""
+        response = httpx.Response(200, content=_chunked(b"0123456789", size=3))
+        reader = openapi_server._AsyncByteReader(response)
+        
+        assert await reader.read(4) == b"0123"
+        assert await reader.read(4) == b"4567"
+        assert await reader.read() == b"89"
+        assert await reader.read(4) == b""
+
+
+@pytest.mark.asyncio
+class TestAiohttpTransport:
+    """Test the optional aiohttp backend (MCP_HTTP_BACKEND=aiohttp) against a local server."""
+
+    @pytest_asyncio.fixture
+    async def local_server(self):
+        """A local aiohttp server with a gzip-encoded endpoint and a slow one."""
+        web = pytest.importorskip("aiohttp.web")
+        from aiohttp.test_utils import TestServer
+
+        async def rappels(request):
+            body = orjson.dumps({"total_count": 0, "results": [], "agent": request.headers.get("X-Test")})
+            return web.Response(body=gzip.compress(body),
+                                headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+
+        async def slow(request):
+            await asyncio.sleep(1)
+            return web.Response(text="late")
+
+        app = web.Application()
+        app.router.add_get("/rappels", rappels)
+        app.router.add_get("/slow", slow)
+        async with TestServer(app) as server:
+            yield server
+
+    async def test_body_and_headers(self, local_server):
+        """Test that request headers reach the server and a gzip body is decoded by httpx."""
+        async with httpx.AsyncClient(transport=AiohttpTransport()) as client:
+            response = await client.get(str(local_server.make_url("/rappels")), headers={"X-Test": "rappel"})
+        
+        assert response.status_code == 200
+        assert response.http_version == "HTTP/1.1"
+        assert response.json() == {"total_count": 0, "results": [], "agent": "rappel"}
+
+    async def test_read_timeout_maps_to_httpx(self, local_server):
+        """Test that the httpx read timeout is applied and raised as an httpx exception."""
+        async with httpx.AsyncClient(transport=AiohttpTransport(), timeout=httpx.Timeout(5.0, read=0.05)) as client:
+            with pytest.raises(httpx.TimeoutException):
+                await client.get(str(local_server.make_url("/slow")))
+
+    async def test_connection_error_maps_to_httpx(self):
+        """Test that a refused connection is raised as httpx.ConnectError."""
+        pytest.importorskip("aiohttp")
+        # A port that was just free: nothing listens on it
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        
+        async with httpx.AsyncClient(transport=AiohttpTransport()) as client:
+            with pytest.raises(httpx.ConnectError):
+                await client.get(f"http://127.0.0.1:{port}/rappels")
+
+
 if __name__ == "__main__":
     # Run tests with pytest
     pytest.main([__file__, "-v"])